@@ -14,151 +14,201 @@ Fixes:
 3. Quick Parse Slash: Add fallback when token lookup fails
 """
 
-import json
+import os
+import re
 import sys
 import shutil
-from datetime import datetime
+import subprocess
+import time
+from pathlib import Path
+from typing import Final
+
+import orjson
+
+from workflow_patching import (
+    apply_patches, compile_patches, load_unless_patched, report_patches, rules_fingerprint, run_cli,
+    save_patched,
+)
 
 WORKFLOW_FILE = '/Users/srikarreddy/Downloads/DemContent/dignitate-workflow-v3-stable.json'
 
-def main():
+# Patch-state sidecar key (see workflow_patching); RULES_HASH is derived from
+# the patches below.
+PATCH_STATE_KEY = 'fix_trend_callback'
+
+# =============================================================================
+# Patch strings, built once at import and shared by every main() call
+# =============================================================================
+
+# Each patch is (old_regex, new_text). The regexes tolerate whitespace drift in
+# the exported JS; the replacement text is inserted verbatim.
+
+# FIX 1: Format Trend Message - callback buttons + one-tap token commands
+FORMAT_TREND_PATCHES: Final[list[tuple[str, str]]] = [
+    # Fix 1a: Change callback buttons to include the topic title
+    # Old: callbackCarousel: '/carousel',\n      callbackVideo: '/video'
+    # New: callbackCarousel: '/carousel ' + title.slice(0, 50), ...
+    (r"callbackCarousel:\s*'/carousel',\s*callbackVideo:\s*'/video'",
+     "callbackCarousel: '/carousel ' + title.slice(0, 50),\n      callbackVideo: '/video ' + title.slice(0, 53)"),
+
+    # Fix 1b: Update trend message to include one-tap token commands
+    # Replace the old "Manual fallback" lines with token-based one-tap commands
+    (r"'Tap the buttons below[^']*',\s*'Manual fallback: /carousel',\s*'Manual fallback: /video'",
+     "'One-tap exact commands (tap these):',\n"
+     "    `/${d.topicToken ? 'carousel' + d.topicToken : 'carousel'}`,\n"
+     "    `/${d.topicToken ? 'video' + d.topicToken : 'video'}`,\n"
+     "    '',\n"
+     "    'Tip: Use the buttons below for reliable one-tap.'"),
+]
+
+# FIX 2: Quick Parse Slash - Replace the "give up" block with fallback logic
+QUICK_PARSE_NEW_BLOCK: Final[str] = (
+    "if (exactTokenCommand && !args) {\n"
+    "  // Token lookup failed - try fallbacks before giving up\n"
+    "  if (sourceMessageText) {\n"
+    "    const sourceTopic = extractTopicFromTrendMessage(sourceMessageText, '/' + actionType);\n"
+    "    if (sourceTopic) {\n"
+    "      args = sourceTopic;\n"
+    "      topicSource = 'source_message_fallback';\n"
+    "    }\n"
+    "  }\n"
+    "  if (!args && fallbackTopic) {\n"
+    "    args = fallbackTopic;\n"
+    "    topicSource = 'memory_fallback';\n"
+    "  }\n"
+    "  if (!args) {\n"
+    "    // Last resort: redirect to trends so user gets fresh topics\n"
+    "    autoAction = actionType;\n"
+    "    actionType = 'trends';\n"
+    "    if (chatKey) staticData.pendingAutoActionByChat[chatKey] = autoAction;\n"
+    "  }\n"
+    "}"
+)
+
+QUICK_PARSE_NEW_NONE_MSG: Final[str] = (
+    "none: 'Tell me what you want to create and the topic, and I will take it from there.'"
+)
+
+QUICK_PARSE_PATCHES: Final[list[tuple[str, str]]] = [
+    (r"if\s*\(exactTokenCommand\s*&&\s*!args\)\s*\{\s*"
+     r"actionType\s*=\s*'none';\s*"
+     r"autoAction\s*=\s*'';\s*"
+     r"\}",
+     QUICK_PARSE_NEW_BLOCK),
+
+    # Also update the error message for the 'none' case
+    (r"none:\s*exactTokenCommand\s*&&\s*!args\s*"
+     r"\?\s*'I could not find that one-tap topic\. Send /trends and tap a fresh one-tap command again\.'\s*"
+     r":\s*'Tell me what you want to create and the topic, and I will take it from there\.'",
+     QUICK_PARSE_NEW_NONE_MSG),
+]
+
+FORMAT_TREND_PATTERN: Final[re.Pattern] = compile_patches(FORMAT_TREND_PATCHES)
+QUICK_PARSE_PATTERN: Final[re.Pattern] = compile_patches(QUICK_PARSE_PATCHES)
+RULES_HASH: Final[str] = rules_fingerprint(FORMAT_TREND_PATCHES, QUICK_PARSE_PATCHES)
+
+def copy_backup(src, dst):
+    """Copy src to dst, letting the kernel/filesystem do the copy where possible."""
+    # Opening dst for writing would truncate src before anything is copied
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f'{src!r} and {dst!r} are the same file')
+    if sys.platform == 'darwin':
+        # APFS clonefile: copy-on-write, no file data is duplicated
+        result = subprocess.run(['cp', '-c', '-p', src, dst], stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            return
+    elif hasattr(os, 'copy_file_range'):
+        # In-kernel copy (reflink on Btrfs/XFS), no bytes pass through Python
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            # A short copy (EOF before st_size) falls through to copy2, which
+            # rewrites dst from scratch
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+def main(workflow_path=WORKFLOW_FILE):
     # Load workflow
-    with open(WORKFLOW_FILE, 'r', encoding='utf-8') as f:
-        workflow = json.load(f)
+    patch_state, workflow = load_unless_patched(workflow_path, PATCH_STATE_KEY, RULES_HASH)
+    if workflow is None:
+        return [('info', f'Already patched (rules {RULES_HASH[:8]}), nothing to do: {workflow_path}')]
 
+    nodes_by_name = {n.get('name'): n for n in workflow['nodes']}
     fixes_applied = []
 
     # =========================================================================
     # FIX 1: Format Trend Message - Include topic in callback buttons + add
     #         one-tap token commands to trend message text
     # =========================================================================
-    for node in workflow['nodes']:
-        if node.get('name') == 'Format Trend Message':
-            old_code = node['parameters']['jsCode']
-
-            # Fix 1a: Change callback buttons to include the topic title
-            # Old: callbackCarousel: '/carousel',\n      callbackVideo: '/video'
-            # New: callbackCarousel: '/carousel ' + title.slice(0, 50), ...
-            new_code = old_code.replace(
-                "callbackCarousel: '/carousel',\n      callbackVideo: '/video'",
-                "callbackCarousel: '/carousel ' + title.slice(0, 50),\n      callbackVideo: '/video ' + title.slice(0, 53)"
-            )
-
-            # Fix 1b: Update trend message to include one-tap token commands
-            # Replace the old "Manual fallback" lines with token-based one-tap commands
-            new_code = new_code.replace(
-                "'Tap the buttons below to generate on this exact topic.',\n    'Manual fallback: /carousel',\n    'Manual fallback: /video'",
-                "'One-tap exact commands (tap these):',\n"
-                "    `/${d.topicToken ? 'carousel' + d.topicToken : 'carousel'}`,\n"
-                "    `/${d.topicToken ? 'video' + d.topicToken : 'video'}`,\n"
-                "    '',\n"
-                "    'Tip: Use the buttons below for reliable one-tap.'"
-            )
-
-            if new_code != old_code:
-                node['parameters']['jsCode'] = new_code
-                fixes_applied.append('✓ Fixed Format Trend Message: callback buttons now include topic title')
-            else:
-                fixes_applied.append('⚠ Format Trend Message: no matching code found (may already be fixed)')
-            break
+    node = nodes_by_name.get('Format Trend Message')
+    if node is None:
+        fixes_applied.append(('error', 'Format Trend Message node not found!'))
     else:
-        fixes_applied.append('✗ Format Trend Message node not found!')
+        old_code = node['parameters']['jsCode']
+
+        # Apply both fixes in a single pass over the JS source
+        new_code, applied, present = apply_patches(old_code, FORMAT_TREND_PATTERN, FORMAT_TREND_PATCHES)
+        if any(applied):
+            node['parameters']['jsCode'] = new_code
+        report_patches(fixes_applied, 'Format Trend Message',
+                       'callback buttons now include topic title', applied, present)
 
     # =========================================================================
     # FIX 2: Quick Parse Slash - Add fallback when token lookup fails
     # =========================================================================
-    for node in workflow['nodes']:
-        if node.get('name') == 'Quick Parse Slash':
-            old_code = node['parameters']['jsCode']
-
-            # Replace the "give up" block with fallback logic
-            old_block = (
-                "if (exactTokenCommand && !args) {\n"
-                "  actionType = 'none';\n"
-                "  autoAction = '';\n"
-                "}"
-            )
-
-            new_block = (
-                "if (exactTokenCommand && !args) {\n"
-                "  // Token lookup failed - try fallbacks before giving up\n"
-                "  if (sourceMessageText) {\n"
-                "    const sourceTopic = extractTopicFromTrendMessage(sourceMessageText, '/' + actionType);\n"
-                "    if (sourceTopic) {\n"
-                "      args = sourceTopic;\n"
-                "      topicSource = 'source_message_fallback';\n"
-                "    }\n"
-                "  }\n"
-                "  if (!args && fallbackTopic) {\n"
-                "    args = fallbackTopic;\n"
-                "    topicSource = 'memory_fallback';\n"
-                "  }\n"
-                "  if (!args) {\n"
-                "    // Last resort: redirect to trends so user gets fresh topics\n"
-                "    autoAction = actionType;\n"
-                "    actionType = 'trends';\n"
-                "    if (chatKey) staticData.pendingAutoActionByChat[chatKey] = autoAction;\n"
-                "  }\n"
-                "}"
-            )
-
-            new_code = old_code.replace(old_block, new_block)
-
-            # Also update the error message for the 'none' case
-            old_none_msg = (
-                "none: exactTokenCommand && !args\n"
-                "    ? 'I could not find that one-tap topic. Send /trends and tap a fresh one-tap command again.'\n"
-                "    : 'Tell me what you want to create and the topic, and I will take it from there.'"
-            )
-
-            new_none_msg = (
-                "none: 'Tell me what you want to create and the topic, and I will take it from there.'"
-            )
-
-            new_code = new_code.replace(old_none_msg, new_none_msg)
-
-            if new_code != old_code:
-                node['parameters']['jsCode'] = new_code
-                fixes_applied.append('✓ Fixed Quick Parse Slash: token miss now falls back to memory/trends')
-            else:
-                fixes_applied.append('⚠ Quick Parse Slash: no matching code found (may already be fixed)')
-            break
+    node = nodes_by_name.get('Quick Parse Slash')
+    if node is None:
+        fixes_applied.append(('error', 'Quick Parse Slash node not found!'))
     else:
-        fixes_applied.append('✗ Quick Parse Slash node not found!')
+        old_code = node['parameters']['jsCode']
+
+        new_code, applied, present = apply_patches(old_code, QUICK_PARSE_PATTERN, QUICK_PARSE_PATCHES)
+        if any(applied):
+            node['parameters']['jsCode'] = new_code
+        report_patches(fixes_applied, 'Quick Parse Slash',
+                       'token miss now falls back to memory/trends', applied, present)
 
     # =========================================================================
     # FIX 3: Fix overlapping node positions
     # =========================================================================
-    collect_pos = None
-    package_pos = None
-    for node in workflow['nodes']:
-        if node.get('name') == 'Collect Images':
-            collect_pos = node.get('position')
-        if node.get('name') == 'Package Carousel Data':
-            package_pos = node.get('position')
-            if package_pos == collect_pos and collect_pos is not None:
-                node['position'] = [collect_pos[0] + 240, collect_pos[1]]
-                fixes_applied.append(f'✓ Fixed Package Carousel Data position: moved from {package_pos} to {node["position"]}')
-            else:
-                fixes_applied.append(f'  Package Carousel Data position OK ({package_pos} vs {collect_pos})')
+    collect = nodes_by_name.get('Collect Images')
+    package = nodes_by_name.get('Package Carousel Data')
+    if package is not None:
+        collect_pos = collect.get('position') if collect is not None else None
+        package_pos = package.get('position')
+        if collect_pos and package_pos and tuple(package_pos) == tuple(collect_pos):
+            package['position'] = [collect_pos[0] + 240, collect_pos[1]]
+            fixes_applied.append(('ok', f'Fixed Package Carousel Data position: moved from {package_pos} to {package["position"]}'))
+        else:
+            fixes_applied.append(('info', f'Package Carousel Data position OK ({package_pos} vs {collect_pos})'))
 
     # =========================================================================
     # Save the fixed workflow
     # =========================================================================
     # Create backup
-    backup_path = WORKFLOW_FILE.replace('.json', f'-backup-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
-    shutil.copy2(WORKFLOW_FILE, backup_path)
-    fixes_applied.append(f'✓ Created backup: {backup_path}')
+    # Hex nanosecond timestamp: fixed width (sorts chronologically) and unique even
+    # across back-to-back runs within the same second
+    p = Path(workflow_path)
+    backup_path = str(p.with_name(f'{p.stem}-backup-{time.time_ns():x}{p.suffix}'))
+    copy_backup(workflow_path, backup_path)
+    fixes_applied.append(('info', f'Created backup: {backup_path}'))
 
     # Write fixed workflow
-    with open(WORKFLOW_FILE, 'w', encoding='utf-8') as f:
-        json.dump(workflow, f, indent=2, ensure_ascii=False)
-
-    fixes_applied.append(f'✓ Saved fixed workflow to: {WORKFLOW_FILE}')
+    save_patched(workflow_path, workflow, patch_state, PATCH_STATE_KEY, RULES_HASH, fixes_applied,
+                 option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
 
-    # Print summary
-    print('\n'.join(fixes_applied))
-    print(f'\nTotal fixes: {len([f for f in fixes_applied if f.startswith("✓")])}')
+    fixes_applied.append(('info', f'Saved fixed workflow to: {workflow_path}'))
+    return fixes_applied
 
 if __name__ == '__main__':
-    main()
+    # Usage: fix_trend_callback.py [workflow.json ...] (defaults to WORKFLOW_FILE)
+    raise SystemExit(run_cli(main, WORKFLOW_FILE))
@@ -1,88 +1,36 @@
 #!/usr/bin/env python3
 """Fix the n8n workflow to properly generate carousel images."""
-import json
-
-# Read the workflow
-with open('/Users/srikarreddy/Downloads/DemContent/dignitate-n8n-workflow.json', 'r') as f:
-    workflow = json.load(f)
-
-# 1. Fix Parse Carousel Response - change 'text' to 'overlayText' in fallback
-for node in workflow['nodes']:
-    if node.get('name') == 'Parse Carousel Response':
-        old_code = node['parameters']['jsCode']
-        new_code = old_code.replace(
-            "{ text: 'Content generation failed'",
-            "{ overlayText: 'Content generation failed'"
-        )
-        node['parameters']['jsCode'] = new_code
-        print("✓ Fixed Parse Carousel Response fallback")
-
-# 2. Add "Split Slides" node
-split_slides_node = {
-    "parameters": {
-        "jsCode": "// Split carousel into individual slides for image generation\nconst carouselData = $input.first().json;\nconst slides = carouselData.slides || [];\n\n// Return first slide for first image (can expand to loop later)\nconst firstSlide = slides[0] || { overlayText: 'Dementia Care Tips', imagePrompt: 'peaceful garden scene with elderly person' };\n\nreturn [{\n  json: {\n    overlayText: firstSlide.overlayText,\n    imagePrompt: firstSlide.imagePrompt,\n    slideIndex: 0,\n    totalSlides: slides.length,\n    title: carouselData.title,\n    slides: carouselData.slides,\n    hashtags: carouselData.hashtags,\n    caption: carouselData.caption,\n    chatId: carouselData.chatId,\n    args: carouselData.args\n  }\n}];"
-    },
-    "id": "split-slides",
-    "name": "Split Slides",
-    "type": "n8n-nodes-base.code",
-    "typeVersion": 2,
-    "position": [1300, 200]
-}
-
-# Find index to insert after Parse Carousel Response
-insert_idx = None
-for i, node in enumerate(workflow['nodes']):
-    if node.get('name') == 'Parse Carousel Response':
-        insert_idx = i + 1
-        break
-
-if insert_idx:
-    workflow['nodes'].insert(insert_idx, split_slides_node)
-    print("✓ Added Split Slides node")
-
-# 3. Update connections
-connections = workflow.get('connections', {})
-
-# Parse Carousel Response -> Split Slides (instead of Status Update)
-connections['Parse Carousel Response'] = {
-    "main": [[{"node": "Split Slides", "type": "main", "index": 0}]]
-}
-
-# Split Slides -> both Status Update AND fal.ai (parallel)
-connections['Split Slides'] = {
-    "main": [[
-        {"node": "Carousel - Status Update", "type": "main", "index": 0},
-        {"node": "fal.ai - Generate Image", "type": "main", "index": 0}
-    ]]
-}
-
-# Remove old Carousel - Status Update connection (it shouldn't connect to fal.ai)
-if 'Carousel - Status Update' in connections:
-    del connections['Carousel - Status Update']
-
-print("✓ Updated workflow connections")
-
-# 4. Update Carousel - Status Update to use Split Slides data
-for node in workflow['nodes']:
-    if node.get('name') == 'Carousel - Status Update':
-        # Update text to reference Split Slides data correctly
-        node['parameters']['text'] = "=🎨 Creating Carousel...\n\n📝 {{ $json.title }}\n📊 {{ $json.totalSlides }} slides\n\n⏳ Generating image with fal.ai..."
-        print("✓ Updated Carousel - Status Update text")
+import re
+from typing import Final
 
-# 5. fal.ai node already expects $json.overlayText and $json.imagePrompt - which Split Slides provides
-for node in workflow['nodes']:
-    if node.get('name') == 'fal.ai - Generate Image':
-        # Verify it uses overlayText and imagePrompt
-        body = node['parameters'].get('jsonBody', '')
-        if 'overlayText' in body and 'imagePrompt' in body:
-            print("✓ fal.ai node already configured correctly")
-        else:
-            print("⚠ fal.ai node needs manual check")
+from workflow_patching import (
+    apply_patches, compile_patches, load_unless_patched, report_patches, rules_fingerprint, run_cli,
+    save_patched,
+)
+
+WORKFLOW_FILE = '/Users/srikarreddy/Downloads/DemContent/dignitate-n8n-workflow.json'
+
+# Patch-state sidecar key (see workflow_patching). The patch below inserts a
+# node, so re-running on its own output must be skipped. RULES_HASH is derived
+# from the patch constants below.
+PATCH_STATE_KEY = 'fix_workflow'
+
+
+# 1. Parse Carousel Response fallback: 'text' -> 'overlayText'
+# (old_regex, new_text) patches, see workflow_patching.compile_patches()
+PARSE_CAROUSEL_PATCHES: Final[list[tuple[str, str]]] = [
+    (r"\{\s*text:\s*'Content generation failed'", "{ overlayText: 'Content generation failed'"),
+]
+PARSE_CAROUSEL_PATTERN: Final[re.Pattern] = compile_patches(PARSE_CAROUSEL_PATCHES)
 
-# 6. Update Package Carousel Data to also include slides info from Split Slides
-for node in workflow['nodes']:
-    if node.get('name') == 'Package Carousel Data':
-        node['parameters']['jsCode'] = """const imageResponse = $input.first().json;
+# 2. Code for the new "Split Slides" node
+SPLIT_SLIDES_JS_CODE: Final[str] = "// Split carousel into individual slides for image generation\nconst carouselData = $input.first().json;\nconst slides = carouselData.slides || [];\n\n// Return first slide for first image (can expand to loop later)\nconst firstSlide = slides[0] || { overlayText: 'Dementia Care Tips', imagePrompt: 'peaceful garden scene with elderly person' };\n\nreturn [{\n  json: {\n    overlayText: firstSlide.overlayText,\n    imagePrompt: firstSlide.imagePrompt,\n    slideIndex: 0,\n    totalSlides: slides.length,\n    title: carouselData.title,\n    slides: carouselData.slides,\n    hashtags: carouselData.hashtags,\n    caption: carouselData.caption,\n    chatId: carouselData.chatId,\n    args: carouselData.args\n  }\n}];"
+
+# 4. Carousel - Status Update text, reading Split Slides data
+CAROUSEL_STATUS_TEXT: Final[str] = "=🎨 Creating Carousel...\n\n📝 {{ $json.title }}\n📊 {{ $json.totalSlides }} slides\n\n⏳ Generating image with fal.ai..."
+
+# 6. Package Carousel Data code, also carrying slides info from Split Slides
+PACKAGE_CAROUSEL_JS_CODE: Final[str] = """const imageResponse = $input.first().json;
 const imageUrl = imageResponse.images?.[0]?.url || imageResponse.data?.images?.[0]?.url || '';
 const slideData = $('Split Slides').first().json;
 return [{ 
@@ -97,11 +45,107 @@ return [{
     firstImageUrl: imageUrl
   } 
 }];"""
-        print("✓ Updated Package Carousel Data")
 
-# Save the updated workflow
-with open('/Users/srikarreddy/Downloads/DemContent/dignitate-n8n-workflow.json', 'w') as f:
-    json.dump(workflow, f, indent=4, ensure_ascii=False)
+RULES_HASH: Final[str] = rules_fingerprint(
+    PARSE_CAROUSEL_PATCHES, SPLIT_SLIDES_JS_CODE, CAROUSEL_STATUS_TEXT, PACKAGE_CAROUSEL_JS_CODE)
+
+
+def main(workflow_path=WORKFLOW_FILE):
+    # Read the workflow
+    patch_state, workflow = load_unless_patched(workflow_path, PATCH_STATE_KEY, RULES_HASH)
+    if workflow is None:
+        return [('info', f"Already patched (rules {RULES_HASH[:8]}), nothing to do: {workflow_path}")]
+
+    messages = []
+    nodes_by_name = {n.get('name'): n for n in workflow['nodes']}
+
+    # 1. Fix Parse Carousel Response - change 'text' to 'overlayText' in fallback
+    node = nodes_by_name.get('Parse Carousel Response')
+    if node is not None:
+        new_code, applied, present = apply_patches(
+            node['parameters']['jsCode'], PARSE_CAROUSEL_PATTERN, PARSE_CAROUSEL_PATCHES)
+        if any(applied):
+            node['parameters']['jsCode'] = new_code
+        report_patches(messages, 'Parse Carousel Response', 'fallback now uses overlayText', applied, present)
+
+    # 2. Add "Split Slides" node
+    split_slides_node = {
+        "parameters": {
+            "jsCode": SPLIT_SLIDES_JS_CODE
+        },
+        "id": "split-slides",
+        "name": "Split Slides",
+        "type": "n8n-nodes-base.code",
+        "typeVersion": 2,
+        "position": [1300, 200]
+    }
+
+    # Find index to insert after Parse Carousel Response
+    insert_idx = None
+    if 'Parse Carousel Response' in nodes_by_name:
+        insert_idx = workflow['nodes'].index(nodes_by_name['Parse Carousel Response']) + 1
+
+    # A run that warned is not recorded as clean and gets re-run, so the node
+    # may already be there from last time
+    if 'Split Slides' in nodes_by_name:
+        messages.append(('info', "Split Slides node already present"))
+    elif insert_idx:
+        workflow['nodes'].insert(insert_idx, split_slides_node)
+        messages.append(('ok', "Added Split Slides node"))
+
+    # 3. Update connections
+    connections = workflow.get('connections', {})
+
+    # Parse Carousel Response -> Split Slides (instead of Status Update)
+    connections['Parse Carousel Response'] = {
+        "main": [[{"node": "Split Slides", "type": "main", "index": 0}]]
+    }
+
+    # Split Slides -> both Status Update AND fal.ai (parallel)
+    connections['Split Slides'] = {
+        "main": [[
+            {"node": "Carousel - Status Update", "type": "main", "index": 0},
+            {"node": "fal.ai - Generate Image", "type": "main", "index": 0}
+        ]]
+    }
+
+    # Remove old Carousel - Status Update connection (it shouldn't connect to fal.ai)
+    if 'Carousel - Status Update' in connections:
+        del connections['Carousel - Status Update']
+
+    messages.append(('ok', "Updated workflow connections"))
+
+    # 4. Update Carousel - Status Update to use Split Slides data
+    node = nodes_by_name.get('Carousel - Status Update')
+    if node is not None:
+        # Update text to reference Split Slides data correctly
+        node['parameters']['text'] = CAROUSEL_STATUS_TEXT
+        messages.append(('ok', "Updated Carousel - Status Update text"))
+
+    # 5. fal.ai node already expects $json.overlayText and $json.imagePrompt - which Split Slides provides
+    node = nodes_by_name.get('fal.ai - Generate Image')
+    if node is not None:
+        # Verify it uses overlayText and imagePrompt
+        body = node['parameters'].get('jsonBody', '')
+        if 'overlayText' in body and 'imagePrompt' in body:
+            messages.append(('info', "fal.ai node already configured correctly"))
+        else:
+            messages.append(('warn', "fal.ai node needs manual check"))
+
+    # 6. Update Package Carousel Data to also include slides info from Split Slides
+    node = nodes_by_name.get('Package Carousel Data')
+    if node is not None:
+        node['parameters']['jsCode'] = PACKAGE_CAROUSEL_JS_CODE
+        messages.append(('ok', "Updated Package Carousel Data"))
+
+    # Save the updated workflow
+    save_patched(workflow_path, workflow, patch_state, PATCH_STATE_KEY, RULES_HASH, messages)
+
+    messages.append(('info', f"Workflow updated successfully: {workflow_path}"))
+    messages.append(('info', "Please re-import the workflow in n8n and test /carousel command"))
+    return messages
+
 
-print("\n✅ Workflow updated successfully!")
-print("Please re-import the workflow in n8n and test /carousel command")
+if __name__ == '__main__':
+    # Usage: fix_workflow.py [workflow.json ...] (defaults to WORKFLOW_FILE)
+    raise SystemExit(run_cli(main, WORKFLOW_FILE))
@@ -3,18 +3,28 @@
 Create a local n8n workflow export with TEST_KEYS filled from environment vars.
 
 This is for local UI testing only. The output filename is gitignored by default.
+Requires orjson (pip install orjson).
 
 Usage:
   OPENROUTER_KEY=... FAL_KEY=... ELEVENLABS_API_KEY=... \\
     python3 tools/make_workflow_local.py \\
       --in dignitate-workflow-v3-stable.json \\
       --out dignitate-workflow-v3-stable.local.json
+
+Pass --compact to write minified JSON (the default when $CI is set to a
+truthy value, i.e. not empty/0/false/no/off).
 """
 
 import argparse
-import json
+import contextlib
+import mmap
 import os
+import pickle
+import shutil
 import sys
+from pathlib import Path
+
+import orjson
 
 
 KEY_MAP = {
@@ -25,19 +35,96 @@ KEY_MAP = {
     "composioKey": "COMPOSIO_API_KEY",
 }
 
-
-def load_json(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def save_json(path: str, obj):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2)
-        f.write("\n")
-
-
-def inject_test_keys(workflow: dict) -> int:
+# Inputs larger than this are written node by node, so the full serialized
+# workflow never sits in memory as one bytes object.
+STREAM_THRESHOLD_BYTES = 16 * 1024 * 1024
+
+# $CI values that mean "not running under CI" (compared case-insensitively).
+_FALSE_ENV_VALUES = {"", "0", "false", "no", "off"}
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() not in _FALSE_ENV_VALUES
+
+
+@contextlib.contextmanager
+def mapped_view(path):
+    """Yield a read-only buffer over the file's contents without copying them.
+
+    The buffer is a memoryview of a read-only mmap; mmap refuses empty files,
+    so for those it is b"" (orjson then reports the empty input as usual).
+    Shared with workflow_patching.py.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            yield view
+
+
+def _loads_mapped(path):
+    with mapped_view(path) as buf:
+        return orjson.loads(buf)
+
+
+def load_json(path: str, cache: bool = False):
+    if not cache:
+        return _loads_mapped(path)
+
+    # <path>.pkl holds the parsed workflow tagged with the source's mtime and
+    # size; any change to the JSON makes the tag mismatch and forces a reparse.
+    src = Path(path)
+    cache_path = Path(path + ".pkl")
+    st = src.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
+    try:
+        cached_stamp, obj = pickle.loads(cache_path.read_bytes())
+        if cached_stamp == stamp:
+            return obj
+    except Exception:
+        # Missing, unreadable or corrupt cache (unpickling can raise almost
+        # anything): fall back to the JSON.
+        pass
+    obj = _loads_mapped(src)
+    try:
+        cache_path.write_bytes(pickle.dumps((stamp, obj), protocol=5))
+    except OSError:
+        # Only --out has to be writable; without a cache the next run just reparses.
+        pass
+    return obj
+
+
+def save_json(path: str, obj, stream: bool = False, compact: bool = False):
+    option = 0 if compact else orjson.OPT_INDENT_2
+    if not stream or not isinstance(obj, dict):
+        Path(path).write_bytes(orjson.dumps(obj, option=option | orjson.OPT_APPEND_NEWLINE))
+        return
+
+    # Same bytes as the single dumps() above, emitted one top-level key (and one
+    # node) at a time. Re-indenting by replacing newlines is safe because JSON
+    # strings never contain a raw newline.
+    indent1, indent2 = (b"", b"") if compact else (b"\n  ", b"\n    ")
+    colon = b":" if compact else b": "
+    with open(path, "wb") as f:
+        for i, (key, value) in enumerate(obj.items()):
+            f.write((b"," if i else b"{") + indent1)
+            f.write(orjson.dumps(key) + colon)
+            if key == "nodes" and isinstance(value, list) and value:
+                for j, node in enumerate(value):
+                    f.write((b"," if j else b"[") + indent2)
+                    f.write(orjson.dumps(node, option=option).replace(b"\n", indent2))
+                f.write(indent1 + b"]")
+            else:
+                f.write(orjson.dumps(value, option=option).replace(b"\n", indent1))
+        if not obj:
+            f.write(b"{")
+        elif not compact:
+            f.write(b"\n")
+        f.write(b"}\n")
+
+
+def inject_test_keys(workflow: dict, keys: dict) -> int:
     nodes = workflow.get("nodes") or []
     for n in nodes:
         if n.get("name") != "TEST_KEYS":
@@ -52,14 +139,7 @@ def inject_test_keys(workflow: dict) -> int:
         for entry in strings:
             if not isinstance(entry, dict):
                 continue
-            name = entry.get("name")
-            if not name:
-                continue
-            env_name = KEY_MAP.get(name)
-            if not env_name:
-                continue
-            v = os.environ.get(env_name, "")
-            if v:
+            if v := keys.get(entry.get("name")):
                 entry["value"] = v
                 updated += 1
         return updated
@@ -71,11 +151,25 @@ def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--in", dest="inp", required=True)
     ap.add_argument("--out", dest="out", required=True)
+    ap.add_argument("--compact", action=argparse.BooleanOptionalAction, default=_env_flag("CI"),
+                    help="write minified JSON (default on when $CI is set; n8n imports either form)")
+    ap.add_argument("--cache", action="store_true",
+                    help="keep a pickled copy of --in next to it (<in>.pkl) to skip the JSON parse on repeat runs")
     args = ap.parse_args()
 
-    wf = load_json(args.inp)
-    updated = inject_test_keys(wf)
-    save_json(args.out, wf)
+    keys = {name: os.environ[env] for name, env in KEY_MAP.items() if os.environ.get(env)}
+    # Always parse and run the TEST_KEYS pass, even with nothing to inject, so a
+    # malformed template or one without a TEST_KEYS node still fails loudly.
+    wf = load_json(args.inp, cache=args.cache)
+    updated = inject_test_keys(wf, keys)
+    if keys or args.compact:
+        save_json(args.out, wf, stream=os.path.getsize(args.inp) > STREAM_THRESHOLD_BYTES, compact=args.compact)
+    else:
+        # Nothing changed: copy the template bytes as-is instead of reserializing.
+        try:
+            shutil.copyfile(args.inp, args.out)
+        except shutil.SameFileError:
+            pass
 
     missing = [env for env in KEY_MAP.values() if not os.environ.get(env)]
     print(f"Wrote {args.out}. Updated {updated} TEST_KEYS field(s).")
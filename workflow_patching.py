@@ -0,0 +1,180 @@
+"""
+Shared plumbing for the fix_*.py workflow patch scripts.
+
+Each patched workflow <stem>.<ext> gets a <stem>.patchstate.json sidecar recording, per
+script, the hash of the last workflow that script wrote, a fingerprint of the
+patch rules it used (rules_fingerprint()) and whether that run was clean (no
+warn or error results). Re-running the same rules on a file they cleanly
+patched is a no-op.
+
+jsCode edits are (old_regex, new_text) patches run through compile_patches(),
+apply_patches() and report_patches().
+
+A script's main(workflow_path) returns (status, message) pairs, where status
+is one of STATUS_SYMBOLS; run_cli() drives it over the command-line files.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import sys
+from pathlib import Path
+
+import orjson
+
+from tools.make_workflow_local import mapped_view
+
+STATUS_SYMBOLS = {'ok': '✓', 'warn': '⚠', 'error': '✗', 'info': ' '}
+
+# Backups the fix scripts write: <stem>-backup-<time_ns as 16 hex digits><suffix>.
+# Hand-named exports such as <stem>-backup-20260211-1714-cleanup.json are real
+# workflows and must not match.
+BACKUP_NAME_PATTERN = re.compile(r'.+-backup-[0-9a-f]{16}(\.[^.]+)?')
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def rules_fingerprint(*rules):
+    """Digest of a script's patch constants, so editing any of them re-arms the script."""
+    return digest(orjson.dumps(rules))
+
+
+def patch_state_path(workflow_path):
+    p = Path(workflow_path)
+    state_path = p.with_name(p.stem + '.patchstate.json')
+    if state_path == p:
+        raise ValueError(f'Patch-state sidecar would overwrite the workflow itself: {workflow_path}')
+    return str(state_path)
+
+
+def load_patch_state(workflow_path):
+    try:
+        return orjson.loads(Path(patch_state_path(workflow_path)).read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+
+def load_unless_patched(workflow_path, state_key, rules_hash):
+    """Return (patch_state, workflow); workflow is None if already cleanly patched.
+
+    The file is hashed and parsed straight from mapped_view(), without
+    copying its contents.
+    """
+    patch_state = load_patch_state(workflow_path)
+    with mapped_view(workflow_path) as raw:
+        if patch_state.get(state_key) == {'input_hash': digest(raw), 'rules_hash': rules_hash, 'clean': True}:
+            return patch_state, None
+        return patch_state, orjson.loads(raw)
+
+
+def save_patched(workflow_path, workflow, patch_state, state_key, rules_hash, results,
+                 option=orjson.OPT_INDENT_2):
+    """Write the patched workflow and remember its hash in the sidecar.
+
+    results are the run's (status, message) pairs so far; a run with any warn
+    or error is not recorded as clean, and the next run patches the file again.
+    """
+    payload = orjson.dumps(workflow, option=option)
+    Path(workflow_path).write_bytes(payload)
+
+    clean = not any(code in ('warn', 'error') for code, _ in results)
+    patch_state[state_key] = {'input_hash': digest(payload), 'rules_hash': rules_hash, 'clean': clean}
+    Path(patch_state_path(workflow_path)).write_bytes(orjson.dumps(patch_state, option=orjson.OPT_INDENT_2))
+
+
+def compile_patches(patches):
+    """Compile (old_regex, new_text) patches into one alternation.
+
+    Every patch contributes two named groups: o<i> for the old code and n<i>
+    for its replacement text, so one scan both applies the patches and tells
+    which ones were already applied.
+    """
+    groups = []
+    for i, (old, new) in enumerate(patches):
+        groups.append(f'(?P<o{i}>{old})')
+        groups.append(f'(?P<n{i}>{re.escape(new)})')
+    return re.compile('|'.join(groups))
+
+
+def apply_patches(code, pattern, patches):
+    """Run a compile_patches() pattern over code in a single pass.
+
+    Returns (new_code, applied, present): per-patch counts of old snippets
+    replaced and of replacement text that was already there.
+    """
+    applied = [0] * len(patches)
+    present = [0] * len(patches)
+
+    def on_match(m):
+        i = int(m.lastgroup[1:])
+        if m.lastgroup[0] == 'o':
+            applied[i] += 1
+            return patches[i][1]
+        present[i] += 1
+        return m.group(0)
+
+    return pattern.sub(on_match, code), applied, present
+
+
+def report_patches(results, node_name, fixed_msg, applied, present):
+    """Append the status lines for one apply_patches() call to results."""
+    drifted = sum(1 for a, p in zip(applied, present) if not a and not p)
+    if any(applied):
+        results.append(('ok', f'Fixed {node_name}: {fixed_msg}'))
+    elif not drifted:
+        results.append(('info', f'{node_name}: already fixed'))
+    if drifted:
+        results.append(('warn', f'{node_name}: {drifted} patch(es) matched nothing (code has drifted?)'))
+
+
+def print_summary(results):
+    print('\n'.join(f'{STATUS_SYMBOLS[code]} {msg}' for code, msg in results))
+    print(f'\nTotal fixes: {sum(1 for code, _ in results if code == "ok")}')
+
+
+def is_generated_file(path):
+    """True for the sidecars and backups the fix scripts write next to a workflow."""
+    name = Path(path).name
+    return name.endswith('.patchstate.json') or BACKUP_NAME_PATTERN.fullmatch(name) is not None
+
+
+def _run_one(main, workflow_path):
+    """Call main, turning an exception into an error line for that file only."""
+    try:
+        return False, main(workflow_path)
+    except Exception as e:
+        return True, [('error', f'{workflow_path}: {type(e).__name__}: {e}')]
+
+
+def run_cli(main, default_path):
+    """Run main over the workflow files named in sys.argv (default_path if none).
+
+    Sidecar and backup files (e.g. picked up by a *.json glob) are skipped.
+    Several files are patched in parallel, one process per file; a failure in
+    one file is reported and the rest of the batch carries on. Returns the
+    process exit code.
+    """
+    files = []
+    for path in sys.argv[1:] or [default_path]:
+        if is_generated_file(path):
+            print(f'{STATUS_SYMBOLS["info"]} Skipping sidecar/backup file: {path}')
+        else:
+            files.append(path)
+
+    run_one = functools.partial(_run_one, main)
+    failures = 0
+    if len(files) <= 1:
+        for failed, results in map(run_one, files):
+            failures += failed
+            print_summary(results)
+    else:
+        import multiprocessing as mp
+        with mp.Pool(min(len(files), os.cpu_count() or 1)) as pool:
+            for failed, results in pool.imap_unordered(run_one, files):
+                failures += failed
+                print_summary(results)
+                print()
+    return 1 if failures else 0